@@ -15,6 +15,7 @@ from werkzeug.exceptions import NotFound
 from .appconfig import Flask
 from .manager import PluginManager
 from .file import Node, secure_filename
+from .stream import coalesce
 from .exceptions import OutsideRemovableBase, OutsideDirectoryBase, \
                         InvalidFilenameError, InvalidPathError
 from . import compat
@@ -135,6 +136,9 @@ def stream_template(template_name, **context):
     Some templates can be huge, this function returns an streaming response,
     sending the content in chunks and preventing from timeout.
 
+    Template output is joined into chunks of, at least, 16KiB (but the first
+    one), as Jinja2 yields many tiny strings.
+
     :param template_name: template
     :param **context: parameters for templates.
     :yields: HTML strings
@@ -142,7 +146,7 @@ def stream_template(template_name, **context):
     app.update_template_context(context)
     template = app.jinja_env.get_template(template_name)
     stream = template.generate(context)
-    return Response(stream_with_context(stream))
+    return Response(stream_with_context(coalesce(stream)))
 
 
 @app.context_processor
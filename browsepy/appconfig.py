@@ -49,9 +49,15 @@ class Config(flask.config.Config):
     def __delitem__(self, k):
         super(Config, self).__delitem__(self.genkey(k))
 
+    def __contains__(self, k):
+        return super(Config, self).__contains__(self.genkey(k))
+
     def get(self, k, default=None):
         return super(Config, self).get(self.genkey(k), default)
 
+    def setdefault(self, k, default=None):
+        return super(Config, self).setdefault(self.genkey(k), default)
+
     def pop(self, k, *args):
         return super(Config, self).pop(self.genkey(k), *args)
 
@@ -328,6 +328,7 @@ if PY_LEGACY:
     unicode = unicode  # noqa
     chr = unichr  # noqa
     bytes = str  # noqa
+    intern = intern  # noqa
 else:
     FileNotFoundError = FileNotFoundError
     range = range
@@ -336,3 +337,4 @@ else:
     unicode = str
     chr = chr
     bytes = bytes
+    intern = sys.intern
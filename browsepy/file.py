@@ -11,8 +11,10 @@ import random
 import datetime
 import logging
 
-from flask import current_app, send_from_directory
+from flask import current_app, send_from_directory, request, \
+                  has_request_context
 from werkzeug.utils import cached_property
+from werkzeug.wsgi import wrap_file
 
 from . import compat
 from .compat import range
@@ -618,17 +620,29 @@ class Directory(Node):
         '''
         Get a Flask Response object streaming a tarball of this directory.
 
+        As :func:`flask.send_file` does, the stream is wrapped with server's
+        ``wsgi.file_wrapper`` when available and passed through as-is, so
+        servers read it in ``directory_tar_buffsize`` blocks on their own
+        terms. Stream is closed along with the response, regardless of the
+        file wrapper closing it or not.
+
         :returns: Response object
         :rtype: flask.Response
         '''
-        return self.app.response_class(
-            TarFileStream(
-                self.path,
-                self.app.config['directory_tar_buffsize'],
-                self.app.config['exclude_fnc'],
-                ),
-            mimetype="application/octet-stream"
+        buffsize = self.app.config['directory_tar_buffsize']
+        stream = TarFileStream(
+            self.path,
+            buffsize,
+            self.app.config['exclude_fnc'],
+            )
+        environ = request.environ if has_request_context() else {}
+        response = self.app.response_class(
+            wrap_file(environ, stream, buffsize),
+            mimetype="application/octet-stream",
+            direct_passthrough=True
             )
+        response.call_on_close(stream.close)
+        return response
 
     def contains(self, filename):
         '''
@@ -587,11 +587,13 @@ class MimetypeActionPluginManager(WidgetPluginManager, MimetypePluginManager):
     @usedoc(WidgetPluginManager.__init__)
     def __init__(self, app=None):
         self._action_widgets = []
+        self._action_index = {}
         super(MimetypeActionPluginManager, self).__init__(app=app)
 
     @usedoc(WidgetPluginManager.clear)
     def clear(self):
         self._action_widgets[:] = ()
+        self._action_index.clear()
         super(MimetypeActionPluginManager, self).clear()
 
     @cached_property
@@ -631,15 +633,35 @@ class MimetypeActionPluginManager(WidgetPluginManager, MimetypePluginManager):
 
     @deprecated('Deprecated method register_action')
     def register_action(self, endpoint, widget, mimetypes=(), **kwargs):
+        if isinstance(endpoint, str):
+            endpoint = compat.intern(endpoint)
         props = self._widget_props(widget, endpoint, mimetypes, True)
         self.register_widget(**props)
+        position = len(self._action_widgets)
         self._action_widgets.append((widget, props['filter'], endpoint))
+        index = self._action_index
+        if not mimetypes:  # filter matches files without type
+            index.setdefault(None, []).append(position)
+        for pattern in mimetypes:
+            major, _, minor = pattern.partition('/')
+            if isinstance(pattern, str):
+                major, minor = compat.intern(major), compat.intern(minor)
+            plain = all(p == '*' or '*' not in p for p in (major, minor))
+            key = (major, minor) if plain else None  # always checked
+            index.setdefault(key, []).append(position)
 
     @deprecated('Deprecated method get_actions')
     def get_actions(self, file):
+        index = self._action_index
+        major, _, minor = file.type.partition('/')
+        positions = set(index.get(None, ()))
+        for key in ((major, minor), (major, '*'), ('*', minor), ('*', '*')):
+            positions.update(index.get(key, ()))
+        widgets = self._action_widgets
         return [
             self.action_class(endpoint, deprecated.for_file(file))
-            for deprecated, filter, endpoint in self._action_widgets
+            for deprecated, filter, endpoint in map(
+                widgets.__getitem__, sorted(positions))
             if endpoint and filter(file)
             ]
 
@@ -95,18 +95,11 @@ class PlayableFile(PlayableBase):
 
     def __init__(self, **kwargs):
         self.duration = kwargs.pop('duration', None)
-        self.title = kwargs.pop('title', None)
+        title = kwargs.pop('title', None)
         super(PlayableFile, self).__init__(**kwargs)
+        self.title = title or self.name
 
-    @property
-    def title(self):
-        return self._title or self.name
-
-    @title.setter
-    def title(self, title):
-        self._title = title
-
-    @property
+    @cached_property
     def media_format(self):
         return self.media_map[self.type]
 
@@ -241,8 +234,6 @@ class PlayableDirectory(Directory):
 
 
 def detect_playable_mimetype(path, os_sep=os.sep):
-    basename = path.rsplit(os_sep)[-1]
-    if '.' in basename:
-        ext = basename.rsplit('.')[-1]
-        return PlayableBase.extensions.get(ext, None)
-    return None
+    basename = path.rpartition(os_sep)[2]
+    _, dot, ext = basename.rpartition('.')
+    return PlayableBase.extensions.get(ext) if dot else None
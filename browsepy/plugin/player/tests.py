@@ -4,6 +4,7 @@ import os.path
 import unittest
 import shutil
 import tempfile
+import collections
 
 import flask
 
@@ -19,11 +20,16 @@ import browsepy.tests.utils as test_utils
 
 
 class ManagerMock(object):
+    __slots__ = (
+        'blueprints', 'mimetype_functions', 'widgets', 'arguments',
+        'argument_values',
+        )
+
     def __init__(self):
-        self.blueprints = []
-        self.mimetype_functions = []
-        self.widgets = []
-        self.arguments = []
+        self.blueprints = collections.deque()
+        self.mimetype_functions = collections.deque()
+        self.widgets = collections.deque()
+        self.arguments = collections.deque()
         self.argument_values = {}
 
     def register_blueprint(self, blueprint):
@@ -44,6 +50,7 @@ class ManagerMock(object):
 
 class TestPlayerBase(unittest.TestCase):
     module = player
+    base = 'c:\\base' if os.name == 'nt' else '/base'
 
     def assertPathEqual(self, a, b):
         return self.assertEqual(
@@ -57,17 +64,24 @@ class TestPlayerBase(unittest.TestCase):
             list(map(os.path.normcase, b))
         )
 
-    def setUp(self):
-        self.base = 'c:\\base' if os.name == 'nt' else '/base'
-        self.app = flask.Flask(self.__class__.__name__)
-        self.app.config['directory_base'] = self.base
-        self.manager = ManagerMock()
+    @classmethod
+    def setUpClass(cls):
+        cls.app = flask.Flask(cls.__name__)
+        cls.app.config['directory_base'] = cls.base
+        cls.app_config = dict(cls.app.config)
+
+    def tearDown(self):
+        self.app.config.clear()
+        self.app.config.update(self.app_config)
 
 
 class TestPlayer(TestPlayerBase):
+    def setUp(self):
+        self.manager = ManagerMock()
+
     def test_register_plugin(self):
         self.module.register_plugin(self.manager)
-        self.assertListEqual(self.manager.arguments, [])
+        self.assertListEqual(list(self.manager.arguments), [])
 
         self.assertIn(self.module.player, self.manager.blueprints)
         self.assertIn(
@@ -147,13 +161,12 @@ class TestIntegration(TestIntegrationBase):
 class TestPlayable(TestIntegrationBase):
     module = player_playable
 
-    def setUp(self):
-        super(TestPlayable, self).setUp()
-        self.manager = self.manager_module.MimetypePluginManager(
-            self.app
-            )
-        self.manager.register_mimetype_function(
-            self.player_module.playable.detect_playable_mimetype
+    @classmethod
+    def setUpClass(cls):
+        super(TestPlayable, cls).setUpClass()
+        cls.manager = cls.manager_module.MimetypePluginManager(cls.app)
+        cls.manager.register_mimetype_function(
+            cls.player_module.playable.detect_playable_mimetype
             )
 
     def test_normalize_playable_path(self):
@@ -183,21 +196,21 @@ class TestPlayable(TestIntegrationBase):
             )
 
     def test_playablefile(self):
-        exts = {
-         'mp3': 'mp3',
-         'wav': 'wav',
-         'ogg': 'ogg'
-        }
-        for ext, media_format in exts.items():
-            pf = self.module.PlayableFile(path='asdf.%s' % ext, app=self.app)
-            self.assertEqual(pf.media_format, media_format)
-            self.assertEqual(pf.title, 'asdf.%s' % ext)
+        exts = ('mp3', 'wav', 'ogg')
+        files = [
+            self.module.PlayableFile(path='asdf.%s' % ext, app=self.app)
+            for ext in exts
+            ]
+        self.assertEqual(
+            [(pf.media_format, pf.title) for pf in files],
+            [(ext, 'asdf.%s' % ext) for ext in exts]
+            )
 
     def test_playabledirectory(self):
         tmpdir = tempfile.mkdtemp()
         try:
             file = p(tmpdir, 'playable.mp3')
-            open(file, 'w').close()
+            test_utils.touch(file)
             node = browsepy_file.Directory(tmpdir)
             self.assertTrue(self.module.PlayableDirectory.detect(node))
 
@@ -1,9 +1,543 @@
 
 import os
+import io
 import os.path
+import sys
+import stat
+import zlib
+import errno
+import atexit
+import struct
 import tarfile
+import operator
 import functools
+import collections
 import threading
+import subprocess
+import multiprocessing
+import multiprocessing.pool
+
+from . import compat
+
+try:
+    from isal.igzip import IGzipFile
+except ImportError:
+    IGzipFile = None
+
+try:
+    from zlib_ng.gzip_ng import GzipNgFile
+except ImportError:
+    GzipNgFile = None
+
+try:
+    from isal.isal_zlib import crc32
+except ImportError:
+    from zlib import crc32
+
+try:
+    from os import sendfile
+except ImportError:
+    sendfile = None
+
+try:
+    from os import posix_fadvise, POSIX_FADV_WILLNEED
+except ImportError:
+    posix_fadvise = POSIX_FADV_WILLNEED = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+F_SETPIPE_SZ = 1031 if sys.platform.startswith('linux') else None
+
+
+def coalesce(iterable, size=16384):
+    '''
+    Join string items into chunks of, at least, given size (but the first
+    and last ones), so streamed responses are not sent on many tiny writes.
+
+    First item is yielded as is, so response starts as soon as possible.
+
+    :param iterable: iterable of strings
+    :type iterable: iterable
+    :param size: minimum chunk length, defaults to 16384
+    :type size: int
+    :yields: joined strings
+    :ytype: str
+    '''
+    iterator = iter(iterable)
+    for item in iterator:
+        yield item
+        break
+    buffer = []
+    buffered = 0
+    for item in iterator:
+        buffer.append(item)
+        buffered += len(item)
+        if buffered >= size:
+            yield ''.join(buffer)
+            del buffer[:]
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def deflate_block(data, level, last=False):
+    '''
+    Compress data as an independent raw deflate block sequence, ended by a
+    sync flush (so it can be followed by other ones) or as final block.
+
+    :param data: data to compress
+    :type data: bytes
+    :param level: compression level
+    :type level: int
+    :param last: whether this is the final block or not
+    :type last: bool
+    :returns: raw deflate data
+    :rtype: bytes
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipFile(object):
+    '''
+    Write-only gzip file object compressing blocks of :attr:`block_size`
+    bytes concurrently on a shared thread pool, as :mod:`zlib` releases
+    the GIL while compressing, writing them in order into given file object.
+
+    Blocks are compressed independently, so ratio gets slightly worse than
+    with a single compressor.
+
+    Gzip trailer checksum uses ISA-L's SIMD CRC32 when installed.
+
+    The shared pool is shut down at interpreter exit, and replaced on
+    forked processes (ie. preloading WSGI servers), as pool threads do not
+    survive a fork.
+    '''
+    block_size = 131072
+    pool_class = multiprocessing.pool.ThreadPool
+    pool_lock = threading.Lock()
+    pool_workers = 1
+    pool_pid = None
+    pool = None
+
+    @classmethod
+    def get_pool(cls):
+        '''
+        Get thread pool shared between instances, creating it if necessary
+        or if current process is not the one which created it.
+
+        :returns: thread pool
+        :rtype: multiprocessing.pool.ThreadPool
+        '''
+        with cls.pool_lock:
+            pid = os.getpid()
+            if cls.pool is None or cls.pool_pid != pid:
+                try:
+                    workers = multiprocessing.cpu_count()
+                except NotImplementedError:
+                    workers = 1
+                cls.pool = cls.pool_class(workers)
+                cls.pool_workers = workers
+                cls.pool_pid = pid
+                atexit.register(cls.close_pool)
+            return cls.pool
+
+    @classmethod
+    def close_pool(cls):
+        '''
+        Shut down shared thread pool, if created by current process,
+        waiting for its workers to finish.
+        '''
+        with cls.pool_lock:
+            pool, cls.pool = cls.pool, None
+            owned = cls.pool_pid == os.getpid()
+        if pool is not None and owned:
+            pool.close()
+            pool.join()
+
+    def __init__(self, fileobj, mode='wb', filename='', mtime=0,
+                 compresslevel=9):
+        '''
+        :param fileobj: file object compressed data will be written to
+        :type fileobj: file
+        :param mode: file mode, only write is supported
+        :type mode: str
+        :param filename: ignored, kept for :class:`gzip.GzipFile` parity
+        :type filename: str
+        :param mtime: modification time written on gzip header
+        :type mtime: int
+        :param compresslevel: compression level, defaults to 9
+        :type compresslevel: int
+        '''
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self._pool = self.get_pool()
+        self._max_pending = self.pool_workers * 2
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._crc = crc32(b'')
+        self._size = 0
+        self._closed = False
+        fileobj.write(struct.pack(
+            '<4sIBB', b'\x1f\x8b\x08\x00', int(mtime or 0), 0, 255))
+
+    def _submit(self, data, last=False):
+        '''
+        Queue block compression, writing already compressed blocks in order
+        and waiting for them when too many are pending.
+
+        :param data: block data
+        :type data: bytes
+        :param last: whether this is the final block or not
+        :type last: bool
+        '''
+        pending = self._pending
+        limit = self._max_pending
+        pending.append(self._pool.apply_async(
+            deflate_block, (data, self.compresslevel, last)))
+        while pending and (pending[0].ready() or len(pending) > limit):
+            self.fileobj.write(pending.popleft().get())
+
+    def write(self, data):
+        '''
+        Compress data.
+
+        :param data: data to compress
+        :type data: bytes
+        :returns: number of bytes written
+        :rtype: int
+        '''
+        self._crc = crc32(data, self._crc)
+        self._size += len(data)
+        buffer = self._buffer
+        buffer.extend(data)
+        block_size = self.block_size
+        if len(buffer) >= block_size:
+            end = len(buffer) - len(buffer) % block_size
+            for start in range(0, end, block_size):
+                self._submit(bytes(buffer[start:start + block_size]))
+            del buffer[:end]
+        return len(data)
+
+    def set_compresslevel(self, level):
+        '''
+        Change compression level for data written from now on, compressing
+        already buffered data as a block with previous level if different.
+
+        :param level: compression level
+        :type level: int
+        '''
+        if level != self.compresslevel and not self._closed:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                del self._buffer[:]
+            self.compresslevel = level
+
+    def close(self):
+        '''
+        Compress pending data and write gzip trailer, once.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._submit(bytes(self._buffer), last=True)
+        del self._buffer[:]
+        while self._pending:
+            self.fileobj.write(self._pending.popleft().get())
+        self.fileobj.write(struct.pack(
+            '<II', self._crc & 0xffffffff, self._size & 0xffffffff))
+
+
+class HeaderCache(object):
+    '''
+    Bounded thread-safe mapping, discarding least recently used items once
+    :attr:`maxsize` is reached, used to keep serialized tar headers.
+    '''
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Get cached value, marking it as recently used.
+
+        :param key: cache key
+        :type key: hashable
+        :returns: cached value or None
+        :rtype: bytes or None
+        '''
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        '''
+        Cache given value, discarding least recently used one if full.
+
+        :param key: cache key
+        :type key: hashable
+        :param value: value to cache
+        :type value: bytes
+        '''
+        with self._lock:
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class StreamTarFile(tarfile.TarFile):
+    '''
+    Tarfile copying member contents on big chunks (see
+    :attr:`copy_bufsize`), so time gets spent on file reads and compression,
+    both releasing the GIL, rather than on per-chunk interpreter overhead.
+
+    When writing an uncompressed stream into a real file descriptor (ie. an
+    external compressor pipe), member contents are copied by the kernel
+    using :func:`os.sendfile`, skipping userspace entirely.
+
+    Serialized member headers are kept on :attr:`header_cache`, shared
+    between instances, so unchanged files downloaded again do not need
+    their headers being built again.
+    '''
+    copy_bufsize = 262144
+    sendfile_errors = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK)
+    header_cache = HeaderCache()
+    header_key = operator.attrgetter(
+        'name', 'mode', 'uid', 'gid', 'size', 'mtime', 'type', 'linkname',
+        'uname', 'gname', 'devmajor', 'devminor'
+        )
+
+    def _header(self, tarinfo):
+        '''
+        Get serialized header of given member, from :attr:`header_cache`
+        when possible.
+
+        :param tarinfo: member info
+        :type tarinfo: tarfile.TarInfo
+        :returns: header blocks
+        :rtype: bytes
+        '''
+        cache = self.header_cache
+        if cache is None or tarinfo.pax_headers:
+            return self._tobuf(tarinfo)
+        key = (
+            self.format, self.encoding, self.errors, self.header_key(tarinfo))
+        buf = cache.get(key)
+        if buf is None:
+            buf = self._tobuf(tarinfo)
+            cache.set(key, buf)
+        return buf
+
+    def _tobuf(self, tarinfo):
+        '''
+        Serialize header of given member using archive format, with
+        :data:`tarfile.USTAR_FORMAT` falling back to
+        :data:`tarfile.PAX_FORMAT` for members not fitting on it.
+
+        :param tarinfo: member info
+        :type tarinfo: tarfile.TarInfo
+        :returns: header blocks
+        :rtype: bytes
+        '''
+        if self.format == tarfile.USTAR_FORMAT:
+            try:
+                return tarinfo.tobuf(self.format, self.encoding, self.errors)
+            except ValueError:  # name too long or number overflow
+                return tarinfo.tobuf(
+                    tarfile.PAX_FORMAT, self.encoding, self.errors)
+        return tarinfo.tobuf(self.format, self.encoding, self.errors)
+
+    def _sendfile(self, fileobj, size):
+        '''
+        Copy file data into uncompressed stream using :func:`os.sendfile`,
+        if possible.
+
+        :param fileobj: member data file object
+        :type fileobj: file
+        :param size: number of bytes to copy
+        :type size: int
+        :returns: whether data has been copied or not
+        :rtype: bool
+        '''
+        stream = self.fileobj
+        if not sendfile or getattr(stream, 'comptype', None) != 'tar':
+            return False
+        try:
+            in_fd = fileobj.fileno()
+            out_fd = stream.fileobj.fileno()
+            offset = fileobj.tell()
+        except (AttributeError, ValueError, IOError, OSError):
+            return False
+        self.flush()
+        stream.fileobj.flush()
+        remaining = size
+        while remaining:
+            try:
+                sent = sendfile(out_fd, in_fd, offset, remaining)
+            except OSError as e:
+                if remaining == size and e.errno in self.sendfile_errors:
+                    return False
+                raise
+            if not sent:
+                raise IOError('unexpected end of data')
+            offset += sent
+            remaining -= sent
+        stream.pos += size
+        return True
+
+    def flush(self):
+        '''
+        Write data pending on stream buffer into underlying file object, as
+        its compression (if any) is not handled by tarfile itself.
+        '''
+        stream = self.fileobj
+        if getattr(stream, 'comptype', None) == 'tar' and stream.buf:
+            stream.fileobj.write(stream.buf)
+            stream.buf = b''
+
+    def _write(self, data):
+        '''
+        Write data into stream, with chunks bigger than stream buffer being
+        written at once along with pending buffered data (ie. their member
+        header) instead of being split into buffer-sized writes.
+
+        :param data: data to write
+        :type data: bytes
+        '''
+        stream = self.fileobj
+        if getattr(stream, 'comptype', None) != 'tar' or \
+                len(data) < stream.bufsize:
+            stream.write(data)
+            return
+        stream.fileobj.write(stream.buf + data if stream.buf else data)
+        stream.buf = b''
+        stream.pos += len(data)
+
+    def _iter_copyfile(self, fileobj, size):
+        '''
+        Copy file data into stream, on :attr:`copy_bufsize` chunks, yielding
+        after every one.
+
+        :param fileobj: member data file object
+        :type fileobj: file
+        :param size: number of bytes to copy
+        :type size: int
+        :yields: None, after every chunk
+        '''
+        read = fileobj.read
+        write = self._write
+        bufsize = self.copy_bufsize
+        remaining = size
+        while remaining:
+            data = read(min(bufsize, remaining))
+            if not data:
+                raise IOError('unexpected end of data')
+            write(data)
+            remaining -= len(data)
+            yield
+
+    def statinfo(self, path, arcname, st):
+        '''
+        Create :class:`tarfile.TarInfo` from an already known
+        :func:`os.lstat` result (ie. from :meth:`os.DirEntry.stat`), like
+        :meth:`tarfile.TarFile.gettarinfo` does but without calling stat
+        again nor resolving owner and group names.
+
+        :param path: file path, only used to read symlink targets
+        :type path: str
+        :param arcname: name on archive
+        :type arcname: str
+        :param st: stat result of path, not following symlinks
+        :type st: os.stat_result
+        :returns: member info or None if file type is not supported
+        :rtype: tarfile.TarInfo or None
+        '''
+        mode = st.st_mode
+        inode = (st.st_ino, st.st_dev)
+        linkname = ''
+        size = 0
+        if stat.S_ISREG(mode):
+            if st.st_nlink > 1 and inode in self.inodes:
+                type = tarfile.LNKTYPE
+                linkname = self.inodes[inode]
+            else:
+                type = tarfile.REGTYPE
+                size = st.st_size
+                if inode[0]:
+                    self.inodes[inode] = arcname
+        elif stat.S_ISDIR(mode):
+            type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            type = tarfile.SYMTYPE
+            linkname = os.readlink(path)
+        elif stat.S_ISFIFO(mode):
+            type = tarfile.FIFOTYPE
+        elif stat.S_ISCHR(mode):
+            type = tarfile.CHRTYPE
+        elif stat.S_ISBLK(mode):
+            type = tarfile.BLKTYPE
+        else:
+            return None
+        tarinfo = self.tarinfo(arcname)
+        tarinfo.mode = mode
+        tarinfo.uid = st.st_uid
+        tarinfo.gid = st.st_gid
+        tarinfo.size = size
+        tarinfo.mtime = st.st_mtime
+        tarinfo.type = type
+        tarinfo.linkname = linkname
+        if type in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+            tarinfo.devmajor = os.major(st.st_rdev)
+            tarinfo.devminor = os.minor(st.st_rdev)
+        return tarinfo
+
+    def addfile(self, tarinfo, fileobj=None):
+        '''
+        Add given :class:`tarfile.TarInfo` object to the archive, with data
+        taken from fileobj if given.
+
+        :param tarinfo: member info
+        :type tarinfo: tarfile.TarInfo
+        :param fileobj: member data file object
+        :type fileobj: file
+        '''
+        for _ in self.iter_addfile(tarinfo, fileobj):
+            pass
+
+    def iter_addfile(self, tarinfo, fileobj=None):
+        '''
+        Add given :class:`tarfile.TarInfo` object to the archive, with data
+        taken from fileobj if given, yielding after every data chunk so
+        archive can be generated step by step.
+
+        :param tarinfo: member info
+        :type tarinfo: tarfile.TarInfo
+        :param fileobj: member data file object
+        :type fileobj: file
+        :yields: None, after every data chunk
+        '''
+        self._check('awx')
+        buf = self._header(tarinfo)
+        self.fileobj.write(buf)
+        self.offset += len(buf)
+        if fileobj is not None:
+            if not self._sendfile(fileobj, tarinfo.size):
+                for _ in self._iter_copyfile(fileobj, tarinfo.size):
+                    yield
+            blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+            if remainder:
+                self.fileobj.write(
+                    tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            self.offset += blocks * tarfile.BLOCKSIZE
+        self.members.append(tarinfo)
 
 
 class TarFileStream(object):
@@ -13,136 +547,470 @@ class TarFileStream(object):
     Buffsize can be provided, it must be 512 multiple (the tar block size) for
     compression.
 
-    Note on corroutines: this class uses threading by default, but
+    Compression level defaults to 1, fast enough to keep up with most
+    connections, as ratio gains on higher levels are small. Gzip header is
+    generated without timestamp and members without ownership data, so
+    archives of unchanged directories are byte-for-byte identical.
+
+    Compression is delegated to an external multi-threaded command (see
+    :attr:`compress_command`) when found on PATH, so it does not compete
+    for the GIL, falling back to :attr:`gzip_class` (ISA-L's accelerated
+    :class:`isal.igzip.IGzipFile` or zlib-ng's
+    :class:`zlib_ng.gzip_ng.GzipNgFile`, when installed), then to
+    :attr:`fallback_compress_command` (still a separate process) and
+    :class:`ParallelGzipFile` otherwise.
+
+    Members with a known compressed file extension (see
+    :attr:`stored_extensions`) are stored without compression only when the
+    gzip writer supports changing its level, that is, with the last-resort
+    :class:`ParallelGzipFile`. External commands and :attr:`gzip_class`
+    writers deflate every member.
+
+    In-process compression runs inline, step by step as data is read,
+    without any thread involved, while external compressors are fed from
+    a thread.
+
+    Note on corroutines: this class uses threading when required, but
     corroutine-based applications can change this behavior overriding the
-    :attr:`event_class` and :attr:`thread_class` values.
+    :attr:`thread_class` value.
     '''
-    event_class = threading.Event
     thread_class = threading.Thread
-    tarfile_class = tarfile.open
+    tarfile_class = StreamTarFile.open
+    tarfile_format = tarfile.USTAR_FORMAT
+    popen_class = subprocess.Popen
+    compress_command = ('pigz', '-c', '-n')
+    fallback_compress_command = ('gzip', '-c', '-n')
+    compress_pipe_size = 1048576
+    prefetch_size = 1048576
+    prefetch_depth = 4
+    gzip_class = IGzipFile or GzipNgFile
+    stored_extensions = frozenset((
+        '.7z', '.avi', '.bz2', '.flac', '.gif', '.gz', '.jpeg', '.jpg',
+        '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.opus', '.png',
+        '.rar', '.tgz', '.webm', '.webp', '.xz', '.zip', '.zst',
+        ))
 
-    def __init__(self, path, buffsize=10240, exclude=None):
+    def __init__(self, path, buffsize=65536, exclude=None, compresslevel=1):
         '''
-        Internal tarfile object will be created, and compression will start
-        on a thread until buffer became full with writes becoming locked until
-        a read occurs.
+        Internal tarfile object (and external compressor, if any) will be
+        created, and compression will start, once first read occurs, either
+        inline or on a thread feeding the external compressor.
+
+        Deferring compression means responses never consumed (ie. HEAD
+        requests or clients disconnecting early) cost neither a thread nor
+        an external compressor process.
 
         :param path: local path of directory whose content will be compressed.
         :type path: str
-        :param buffsize: size of internal buffer on bytes, defaults to 10KiB
+        :param buffsize: size of internal buffer on bytes, defaults to 64KiB
         :type buffsize: int
         :param exclude: path filter function, defaults to None
         :type exclude: callable
+        :param compresslevel: compression level, defaults to 1
+        :type compresslevel: int
         '''
         self.path = path
         self.name = os.path.basename(path) + ".tgz"
         self.exclude = exclude
+        self.compresslevel = compresslevel
+
+        self._closed = False
+        self._pending = bytes()
+        self._buffsize = buffsize
+        self._chunks = []
+        self._compressor = None
+        self._gzip = None
+        self._tarfile = None
+        self._retrieve = None
+        self._started = False
+        self._generator = None
+        self._th = None
+        self._error = None
 
-        self._finished = 0
-        self._want = 0
-        self._data = bytes()
-        self._add = self.event_class()
-        self._result = self.event_class()
+    def _start(self):
+        '''
+        Start compression, opening the external compressor if available,
+        and running either inline using :meth:`generate` or on a thread
+        running :meth:`fill`.
+        '''
+        self._started = True
+        buffsize = self._buffsize
+        compressor = self._compressor = self._open_compressor()
+        if not compressor:
+            self._gzip = (self.gzip_class or ParallelGzipFile)(
+                fileobj=self,
+                mode="wb",
+                filename="",
+                mtime=0,
+                compresslevel=self.compresslevel
+                )
         self._tarfile = self.tarfile_class(  # stream write
-            fileobj=self,
-            mode="w|gz",
-            bufsize=buffsize
+            fileobj=self._gzip or compressor.stdin,
+            mode="w|",
+            bufsize=buffsize,
+            format=self.tarfile_format
             )
-        self._th = self.thread_class(target=self.fill)
-        self._th.start()
+        if compressor:
+            self._retrieve = functools.partial(
+                compressor.stdout.read, buffsize)
+            self._th = self.thread_class(target=self.fill)
+            self._th.start()
+        else:
+            self._generator = self.generate()
+            self._retrieve = functools.partial(next, self._generator, b'')
+
+    def _open_compressor(self):
+        '''
+        Start external compression process if :attr:`compress_command` is
+        available, or :attr:`fallback_compress_command` if :attr:`gzip_class`
+        is not.
+
+        Process stdout is left unbuffered, so reads return as soon as any
+        data is available, but stdin is buffered, as raw pipe writes can be
+        partial (ie. when interrupted by a signal) and tarfile does not
+        retry them.
+
+        :returns: process object or None
+        :rtype: subprocess.Popen or None
+        '''
+        commands = (self.compress_command,)
+        if not self.gzip_class:
+            commands += (self.fallback_compress_command,)
+        for command in commands:
+            executable = command and compat.which(command[0])
+            if not executable:
+                continue
+            try:
+                process = self.popen_class(
+                    (executable, '-%d' % self.compresslevel) +
+                    tuple(command[1:]),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    bufsize=0
+                    )
+            except OSError:
+                continue
+            if isinstance(process.stdin, io.RawIOBase):
+                process.stdin = io.BufferedWriter(
+                    process.stdin, self._buffsize)
+            self._resize_pipe(process.stdin)
+            self._resize_pipe(process.stdout)
+            return process
+        return None
+
+    def _resize_pipe(self, pipe):
+        '''
+        Grow kernel buffer of given pipe to :attr:`compress_pipe_size`, where
+        supported, so both tarfile and compressor can run further ahead of
+        their respective readers.
+
+        :param pipe: pipe file object
+        :type pipe: file
+        '''
+        if fcntl and F_SETPIPE_SZ and self.compress_pipe_size:
+            try:
+                fcntl.fcntl(pipe, F_SETPIPE_SZ, self.compress_pipe_size)
+            except (IOError, OSError):  # over system limit
+                pass
+
+    def _iter_entries(self):
+        '''
+        Iterate through directory contents, recursively, skipping excluded
+        entries (along with their whole subtree) before any tar header gets
+        built for them.
+
+        Entries are yielded depth-first and sorted by name, as
+        :meth:`tarfile.TarFile.add` does since Python 3.7, so archive layout
+        does not depend on filesystem directory order.
+
+        :yields: tuples of :func:`os.scandir` entry and archive name
+        :ytype: tuple of os.DirEntry and str
+        '''
+        exclude = self.exclude
+        scandir = compat.scandir
+        name = operator.attrgetter('name')
+
+        def listdir(path, prefix):
+            entries = sorted(scandir(path), key=name)
+            return iter([
+                (entry, prefix + entry.name)
+                for entry in entries
+                if not (exclude and exclude(entry.path))
+                ])
+
+        stack = [listdir(self.path, '')]
+        while stack:
+            for entry, arcname in stack[-1]:
+                yield entry, arcname
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(listdir(entry.path, arcname + '/'))
+                    break
+            else:
+                stack.pop()
+
+    def _prefetch(self, path):
+        '''
+        Open given file ahead of archiving, hinting the kernel to start
+        reading it (up to :attr:`prefetch_size`) in background, so disk
+        latency overlaps with the archiving of the previous
+        :attr:`prefetch_depth` entries.
+
+        The returned file object is the one later read by :meth:`_iter_add`.
+
+        :param path: file path
+        :type path: str
+        :returns: file object, or None if file cannot be opened
+        :rtype: file or None
+        '''
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            posix_fadvise(
+                f.fileno(), 0, self.prefetch_size, POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        return f
+
+    def _infofilter(self, tarinfo):
+        '''
+        Strip ownership data from member info.
+
+        :param tarinfo: member info
+        :type tarinfo: tarfile.TarInfo
+        :returns: given member info
+        :rtype: tarfile.TarInfo
+        '''
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = ''
+        return tarinfo
+
+    def _is_compressed(self, name):
+        '''
+        Get whether given file name looks like already compressed data,
+        based on its extension and :attr:`stored_extensions`.
+
+        :param name: file name
+        :type name: str
+        :returns: True if file data is not worth compressing
+        :rtype: bool
+        '''
+        return os.path.splitext(name)[1].lower() in self.stored_extensions
+
+    def _set_compresslevel(self, level):
+        '''
+        Change compression level of in-process gzip writer, if supported
+        (only :class:`ParallelGzipFile`), so already compressed members are
+        stored instead of deflated again; otherwise this is a no-op.
+
+        :param level: compression level
+        :type level: int
+        '''
+        setter = getattr(self._gzip, 'set_compresslevel', None)
+        if setter:
+            self._tarfile.flush()
+            setter(level)
+
+    def _iter_add(self, path, arcname, st=None, fileobj=None):
+        '''
+        Add given path to internal tarfile instance, non recursively,
+        yielding after every data chunk.
+
+        :param path: file path
+        :type path: str
+        :param arcname: name on archive
+        :type arcname: str
+        :param st: stat result of path (not following symlinks) if known
+        :type st: os.stat_result
+        :param fileobj: already open file object of path, closed after use
+        :type fileobj: file or None
+        :yields: None, after every data chunk
+        '''
+        try:
+            tar = self._tarfile
+            tarinfo = tar.statinfo(path, arcname, st or os.lstat(path))
+            if tarinfo is None:  # unsupported file type
+                return
+            tarinfo = self._infofilter(tarinfo)
+            if tarinfo.isreg():
+                self._set_compresslevel(
+                    0 if self._is_compressed(arcname) else self.compresslevel)
+                if fileobj is None:
+                    fileobj = open(path, 'rb')
+                for _ in tar.iter_addfile(tarinfo, fileobj):
+                    yield
+            else:
+                tar.addfile(tarinfo)
+                yield
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+    def _iter_fill(self):
+        '''
+        Write all data into internal tarfile instance, which writes to
+        current object, using :meth:`write`, yielding after every member
+        data chunk.
+
+        :yields: None, after every member data chunk
+        '''
+        add = self._iter_add
+        prefetch = (
+            self._prefetch
+            if posix_fadvise and self.prefetch_size else
+            None
+            )
+        for _ in add(self.path, ""):
+            yield
+        depth = self.prefetch_depth
+        pending = collections.deque()
+        try:
+            for entry, arcname in self._iter_entries():
+                pending.append((
+                    entry.path,
+                    arcname,
+                    entry.stat(follow_symlinks=False),
+                    prefetch(entry.path)
+                    if prefetch and entry.is_file(follow_symlinks=False) else
+                    None,
+                    ))
+                if len(pending) > depth:
+                    for _ in add(*pending.popleft()):
+                        yield
+            while pending:
+                for _ in add(*pending.popleft()):
+                    yield
+        finally:
+            for _, _, _, fileobj in pending:  # aborted
+                if fileobj is not None:
+                    fileobj.close()
+        self._tarfile.close()  # force stream flush
+        if self._gzip:
+            self._gzip.close()  # write gzip trailer
+        yield
+
+    def generate(self):
+        '''
+        Generate tarfile data inline, without any thread involved, as data
+        written by internal tarfile instance is collected between steps.
+
+        This method is called automatically on first :meth:`read` when
+        compression is not delegated to an external command.
+
+        :yields: tarfile data chunks
+        :ytype: bytes
+        '''
+        chunks = self._chunks
+        for _ in self._iter_fill():
+            if chunks:
+                data = b''.join(chunks)
+                del chunks[:]
+                yield data
 
     def fill(self):
         '''
-        Writes data on internal tarfile instance, which writes to current
-        object, using :meth:`write`.
+        Writes data on internal tarfile instance, which writes to external
+        compressor input.
 
         As this method is blocking, it is used inside a thread.
 
-        This method is called automatically, on a thread, on initialization,
-        so there is little need to call it manually.
+        This method is called automatically, on a thread, on first
+        :meth:`read` when required, so there is little need to call it
+        manually.
         '''
-        if self.exclude:
-            exclude = self.exclude
-            ap = functools.partial(os.path.join, self.path)
-            self._tarfile.add(
-                self.path, "",
-                filter=lambda info: None if exclude(ap(info.name)) else info
-                )
-        else:
-            self._tarfile.add(self.path, "")
-        self._tarfile.close()  # force stream flush
-        self._finished += 1
-        if not self._result.is_set():
-            self._result.set()
+        try:
+            for _ in self._iter_fill():
+                pass
+        except Exception as e:
+            if not self._closed:
+                self._error = e  # raised by read
+        finally:
+            try:
+                self._compressor.stdin.close()  # compressor will finish
+            except (IOError, OSError) as e:  # buffered data not written
+                if not self._closed and self._error is None:
+                    self._error = e
 
     def write(self, data):
         '''
-        Write method used by internal tarfile instance to output data.
-        This method blocks tarfile execution once internal buffer is full.
+        Write method used by in-process gzip writer to output data, which
+        is collected by :meth:`generate` between steps.
 
-        As this method is blocking, it is used inside the same thread of
-        :meth:`fill`.
-
-        :param data: bytes to write to internal buffer
+        :param data: bytes to write
         :type data: bytes
         :returns: number of bytes written
         :rtype: int
         '''
-        self._add.wait()
-        self._data += data
-        if len(self._data) > self._want:
-            self._add.clear()
-            self._result.set()
+        if data:
+            self._chunks.append(data)
         return len(data)
 
     def read(self, want=0):
         '''
-        Read method, gets data from internal buffer while releasing
-        :meth:`write` locks when needed.
+        Read method, advancing :meth:`generate` until data is available,
+        so tarfile is streamed on-the-fly, with data chunks being processed
+        and retrieved on demand.
 
-        The lock usage means it must ran on a different thread than
-        :meth:`fill`, ie. the main thread, otherwise will deadlock.
+        When an external compressor is used, data is read straight from its
+        output pipe instead, while being fed by :meth:`fill` on a thread.
 
-        The combination of both write and this method running on different
-        threads makes tarfile being streamed on-the-fly, with data chunks being
-        processed and retrieved on demand.
+        Errors found while generating the tarfile on a thread are raised
+        here, so incomplete archives do not end as if they were complete.
 
-        :param want: number bytes to read, defaults to 0 (all available)
+        :param want: max number bytes to read, defaults to 0 (all available)
         :type want: int
-        :returns: tarfile data as bytes
+        :returns: tarfile data as bytes, empty once stream is exhausted
         :rtype: bytes
         '''
-        if self._finished:
-            if self._finished == 1:
-                self._finished += 1
-                return ""
-            return EOFError("EOF reached")
-
-        # Thread communication
-        self._want = want
-        self._add.set()
-        self._result.wait()
-        self._result.clear()
-
-        if want:
-            data = self._data[:want]
-            self._data = self._data[want:]
+        if not self._started:
+            if self._closed:
+                return bytes()
+            self._start()
+        data = self._pending or self._retrieve()
+        if self._error is not None:
+            raise self._error
+        if want and len(data) > want:
+            data, self._pending = data[:want], data[want:]
         else:
-            data = self._data
-            self._data = bytes()
+            self._pending = bytes()
         return data
 
     def __iter__(self):
         '''
         Iterate through tarfile result chunks.
 
-        Similarly to :meth:`read`, this methos must ran on a different thread
-        than :meth:`write` calls.
-
         :yields: data chunks as taken from :meth:`read`.
         :ytype: bytes
         '''
-        data = self.read()
+        read = self.read
+        data = read()
         while data:
             yield data
-            data = self.read()
+            data = read()
+
+    def close(self):
+        '''
+        Abort compression, terminating the external compressor process if
+        any.
+
+        Pending and further :meth:`write` calls will raise, ending the
+        compression thread.
+        '''
+        self._closed = True
+        if self._generator:
+            self._generator.close()
+        tar = self._tarfile
+        if tar and not tar.closed:  # aborted, do not flush on collection
+            tar.closed = tar.fileobj.closed = True
+        if self._compressor:
+            if self._compressor.poll() is None:
+                self._compressor.terminate()
+            self._compressor.stdout.close()
+            self._compressor.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -9,10 +9,10 @@ import browsepy.file as browsepy_file
 import browsepy.widget as browsepy_widget
 import browsepy.manager as browsepy_manager
 
-from browsepy.tests.deprecated.plugin import player as player
-
 
 class ManagerMock(object):
+    __slots__ = ('blueprints', 'mimetype_functions', 'actions', 'widgets')
+
     def __init__(self):
         self.blueprints = []
         self.mimetype_functions = []
@@ -49,30 +49,34 @@ class ManagerMock(object):
 
 
 class FileMock(object):
-    @property
-    def type(self):
-        return self.mimetype.split(';')[0]
-
-    @property
-    def category(self):
-        return self.mimetype.split('/')[0]
-
     is_directory = False
     name = 'unnamed'
 
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
+        if 'mimetype' in kwargs:
+            self.type = self.mimetype.split(';', 1)[0]
+            self.category = self.type.split('/', 1)[0]
 
 
 class TestPlugins(unittest.TestCase):
     app_module = browsepy
     manager_module = browsepy_manager
+    expected_endpoints = ['test_a_a', 'test_a_x', 'test_x_a', 'test_x_x']
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = cls.app_module.app
+        cls.plugin_namespace, cls.plugin_name = __name__.rsplit('.', 1)
+        cls.original_manager = cls.app.extensions['plugin_manager']
+        cls.manager = cls.manager_module.PluginManager(cls.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.extensions['plugin_manager'] = cls.original_manager
 
     def setUp(self):
-        self.app = self.app_module.app
-        self.manager = self.manager_module.PluginManager(self.app)
         self.original_namespaces = self.app.config['plugin_namespaces']
-        self.plugin_namespace, self.plugin_name = __name__.rsplit('.', 1)
         self.app.config['plugin_namespaces'] = (self.plugin_namespace,)
 
     def tearDown(self):
@@ -88,9 +92,7 @@ class TestPlugins(unittest.TestCase):
             for action in self.manager.get_actions(FileMock(mimetype='a/a'))
             )
 
-        self.assertEqual(
-            endpoints,
-            sorted(('test_x_x', 'test_a_x', 'test_x_a', 'test_a_a')))
+        self.assertEqual(endpoints, self.expected_endpoints)
         self.assertEqual(
             self.app.view_functions['old_test_plugin.root'](),
             'old_test_plugin')
@@ -122,7 +124,6 @@ def register_plugin(manager):
 
 
 class TestPlayerBase(unittest.TestCase):
-    module = player
     scheme = 'test'
     hostname = 'testing'
     urlprefix = '%s://%s' % (scheme, hostname)
@@ -130,13 +131,23 @@ class TestPlayerBase(unittest.TestCase):
     def assertUrlEqual(self, a, b):
         self.assertIn(a, (b, '%s%s' % (self.urlprefix, b)))
 
+    @classmethod
+    def setUpClass(cls):
+        from browsepy.tests.deprecated.plugin import player
+        cls.module = cls.player_module = player
+        cls.app = flask.Flask(cls.__name__)
+        cls.app.config['directory_remove'] = None
+        cls.app.config['SERVER_NAME'] = cls.hostname
+        cls.app.config['PREFERRED_URL_SCHEME'] = cls.scheme
+        cls.app_config = dict(cls.app.config)
+
     def setUp(self):
-        self.app = flask.Flask(self.__class__.__name__)
-        self.app.config['directory_remove'] = None
-        self.app.config['SERVER_NAME'] = self.hostname
-        self.app.config['PREFERRED_URL_SCHEME'] = self.scheme
         self.manager = ManagerMock()
 
+    def tearDown(self):
+        self.app.config.clear()
+        self.app.config.update(self.app_config)
+
 
 class TestPlayer(TestPlayerBase):
     def test_register_plugin(self):
@@ -158,7 +169,6 @@ class TestPlayer(TestPlayerBase):
 
 
 class TestIntegrationBase(TestPlayerBase):
-    player_module = player
     browsepy_module = browsepy
     manager_module = browsepy_manager
     widget_module = browsepy_widget
@@ -208,6 +218,26 @@ class TestIntegration(TestIntegrationBase):
         self.assertEqual(len(actions), 6)
         self.assertEqual(actions[5].widget, widget)
 
+    def test_get_actions(self):
+        manager = self.manager_module.MimetypeActionPluginManager(self.app)
+        widget = self.widget_module.WidgetBase()  # empty
+        manager.register_action('a', widget, mimetypes=('text/*', '*/*'))
+        manager.register_action('b', widget, mimetypes=('image/*',))
+        manager.register_action('c', widget, mimetypes=('text/x-*',))
+        manager.register_action('d', widget, mimetypes=('*/plain',))
+        actions = manager.get_actions(FileMock(mimetype='text/plain'))
+        self.assertEqual([a.endpoint for a in actions], ['a', 'd'])
+        actions = manager.get_actions(FileMock(mimetype='text/x-python'))
+        self.assertEqual([a.endpoint for a in actions], ['a', 'c'])
+        manager.register_action('e', widget)
+        actions = manager.get_actions(FileMock(mimetype=''))
+        self.assertEqual([a.endpoint for a in actions], ['e'])
+        actions = manager.get_actions(FileMock(mimetype='text/plain'))
+        self.assertEqual([a.endpoint for a in actions], ['a', 'd'])
+        manager.clear()
+        actions = manager.get_actions(FileMock(mimetype='text/plain'))
+        self.assertEqual(actions, [])
+
     def test_register_widget(self):
         file = self.file_module.Node()
         manager = self.manager_module.MimetypeActionPluginManager(self.app)
@@ -267,8 +297,6 @@ class TestIntegration(TestIntegrationBase):
 
 
 class TestPlayable(TestIntegrationBase):
-    module = player
-
     def setUp(self):
         super(TestPlayable, self).setUp()
         self.manager = self.manager_module.MimetypeActionPluginManager(
@@ -10,18 +10,28 @@ import browsepy.appconfig
 class TestApp(unittest.TestCase):
     module = browsepy
     app = browsepy.app
+    settings = b'DIRECTORY_DOWNLOADABLE = False\n'
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(cls.settings)
+        cls.settings_path = f.name
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.settings_path)
 
     def test_config(self):
+        original = self.app.config['directory_downloadable']
+        os.environ['BROWSEPY_TEST_SETTINGS'] = self.settings_path
         try:
-            with tempfile.NamedTemporaryFile(delete=False) as f:
-                f.write(b'DIRECTORY_DOWNLOADABLE = False\n')
-                name = f.name
-            os.environ['BROWSEPY_TEST_SETTINGS'] = name
             self.app.config['directory_downloadable'] = True
             self.app.config.from_envvar('BROWSEPY_TEST_SETTINGS')
             self.assertFalse(self.app.config['directory_downloadable'])
         finally:
-            os.remove(name)
+            del os.environ['BROWSEPY_TEST_SETTINGS']
+            self.app.config['directory_downloadable'] = original
 
 
 class TestConfig(unittest.TestCase):
@@ -31,6 +41,8 @@ class TestConfig(unittest.TestCase):
     def test_case_insensitivity(self):
         cfg = self.module.Config(self.pwd, defaults={'prop': 2})
         self.assertEqual(cfg['prop'], cfg['PROP'])
+        self.assertIn('pROp', cfg)
+        self.assertEqual(cfg.setdefault('Prop', 3), 2)
         self.assertEqual(cfg['pRoP'], cfg.pop('prop'))
         cfg.update(prop=1)
         self.assertEqual(cfg['PROP'], 1)
@@ -42,3 +54,6 @@ class TestConfig(unittest.TestCase):
         self.assertRaises(KeyError, cfg.__delitem__, 'prop')
         self.assertIsNone(cfg.pop('prop', None))
         self.assertIsNone(cfg.get('prop'))
+        self.assertNotIn('PROP', cfg)
+        self.assertEqual(cfg.setdefault('pRoP', 3), 3)
+        self.assertEqual(cfg['PROP'], 3)
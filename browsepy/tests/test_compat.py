@@ -1,5 +1,6 @@
 import unittest
 import re
+import warnings
 
 from werkzeug.utils import cached_property
 
@@ -27,23 +28,21 @@ class TestCompat(unittest.TestCase):
 
     def customAssertWarnsRegex(self, expected_warning, expected_regex, fnc,
                                *args, **kwargs):
-
-        import warnings
         old_warn = warnings.warn
         warnings.warn = self._warn
         try:
             fnc(*args, **kwargs)
         finally:
             warnings.warn = old_warn
-        warnings = ()
+        recorded = ()
         if hasattr(self, '_warnings'):
-            warnings = self._warnings
+            recorded = self._warnings
             del self._warnings
         regex = re.compile(expected_regex)
         self.assertTrue(any(
             warn['category'] == expected_warning and
             regex.match(warn['message'])
-            for warn in warnings
+            for warn in recorded
         ))
 
     def test_which(self):
@@ -148,11 +147,13 @@ class TestCompat(unittest.TestCase):
 
     def test_getdebug(self):
         enabled = ('TRUE', 'true', 'True', '1', 'yes', 'enabled')
-        for case in enabled:
-            self.assertTrue(self.module.getdebug({'DEBUG': case}))
         disabled = ('FALSE', 'false', 'False', '', '0', 'no', 'disabled')
-        for case in disabled:
-            self.assertFalse(self.module.getdebug({'DEBUG': case}))
+        expected = dict.fromkeys(enabled, True)
+        expected.update(dict.fromkeys(disabled, False))
+        self.assertEqual(
+            {case: self.module.getdebug({'DEBUG': case}) for case in expected},
+            expected
+            )
 
     def test_deprecated(self):
         environ = {'DEBUG': 'true'}
@@ -8,10 +8,11 @@ import browsepy.transform.htmlcompress
 class TestHTMLCompress(unittest.TestCase):
     extension = browsepy.transform.htmlcompress.HTMLCompress
 
-    def setUp(self):
-        self.env = jinja2.Environment(
+    @classmethod
+    def setUpClass(cls):
+        cls.env = jinja2.Environment(
             autoescape=True,
-            extensions=[self.extension]
+            extensions=[cls.extension]
             )
 
     def render(self, html, **kwargs):
@@ -3,34 +3,42 @@ import os
 import os.path
 import unittest
 import tempfile
-import shutil
-import stat
 
 import browsepy
 import browsepy.file
+import browsepy.stream
 import browsepy.compat
 import browsepy.tests.utils as test_utils
 
 
 PY_LEGACY = browsepy.compat.PY_LEGACY
+FILE_COMMAND = browsepy.compat.which('file')
 
 
 class TestFile(unittest.TestCase):
     module = browsepy.file
 
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        test_utils.rmtree(cls.root)
+
     def setUp(self):
         self.app = browsepy.app  # FIXME
-        self.workbench = tempfile.mkdtemp()
+        self.workbench = tempfile.mkdtemp(dir=self.root)
 
     def clear_workbench(self):
         for entry in browsepy.compat.scandir(self.workbench):
-            if entry.is_dir():
-                shutil.rmtree(entry.path)
+            if entry.is_dir(follow_symlinks=False):
+                test_utils.rmtree(entry.path)
             else:
-                os.remove(entry.path)
+                os.unlink(entry.path)
 
     def tearDown(self):
-        shutil.rmtree(self.workbench)
+        test_utils.rmtree(self.workbench)
         test_utils.clear_flask_context()
 
     def textfile(self, name, text):
@@ -44,15 +52,12 @@ class TestFile(unittest.TestCase):
 
         tmp_txt = self.textfile('somefile.txt', 'a')
 
-        content = list(directory._listdir(precomputed_stats=True))
-        self.assertEqual(len(content), 1)
-        self.assertEqual(content[0].size, '1 B')
-        self.assertEqual(content[0].path, tmp_txt)
-
-        content = list(directory._listdir(precomputed_stats=False))
-        self.assertEqual(len(content), 1)
-        self.assertEqual(content[0].size, '1 B')
-        self.assertEqual(content[0].path, tmp_txt)
+        for precomputed_stats in (True, False):
+            content = [
+                (node.path, node.size)
+                for node in directory._listdir(precomputed_stats)
+                ]
+            self.assertEqual(content, [(tmp_txt, '1 B')])
 
     def test_check_forbidden_filename(self):
         cff = self.module.check_forbidden_filename
@@ -86,7 +91,7 @@ class TestFile(unittest.TestCase):
         tmp_err = os.path.join(self.workbench, 'nonexisting_file')
 
         # test file command
-        if browsepy.compat.which('file'):
+        if FILE_COMMAND:
             f = self.module.File(tmp_txt, app=self.app)
             self.assertEqual(f.mimetype, 'text/plain; charset=us-ascii')
             self.assertEqual(f.type, 'text/plain')
@@ -104,16 +109,11 @@ class TestFile(unittest.TestCase):
         bad_file = os.path.join(bad_path, 'file')
         with open(bad_file, 'w') as f:
             f.write('#!/usr/bin/env bash\nexit 1\n')
-        os.chmod(bad_file, os.stat(bad_file).st_mode | stat.S_IEXEC)
+        os.chmod(bad_file, 0o755)
 
-        old_path = os.environ['PATH']
-        os.environ['PATH'] = bad_path
-
-        try:
+        with test_utils.environ(PATH=bad_path):
             f = self.module.File(tmp_txt, app=self.app)
             self.assertEqual(f.mimetype, 'application/octet-stream')
-        finally:
-            os.environ['PATH'] = old_path
 
     def test_size(self):
         test_file = os.path.join(self.workbench, 'test.csv')
@@ -142,7 +142,7 @@ class TestFile(unittest.TestCase):
         self.assertEqual(f.modified, None)
         self.assertEqual(f.size, None)
 
-        open(virtual_file, 'w').close()
+        test_utils.touch(virtual_file)
         self.assertNotEqual(f.modified, None)
         self.assertNotEqual(f.size, None)
 
@@ -165,7 +165,7 @@ class TestFile(unittest.TestCase):
 
     def test_properties(self):
         empty_file = os.path.join(self.workbench, 'empty.txt')
-        open(empty_file, 'w').close()
+        test_utils.touch(empty_file)
         f = self.module.File(empty_file, app=self.app)
 
         self.assertEqual(f.name, 'empty.txt')
@@ -188,6 +188,28 @@ class TestFile(unittest.TestCase):
         d = self.module.Directory(self.workbench, app=self.app)
         self.assertEqual(d.is_empty, True)
 
+    def test_download(self):
+        self.textfile('somefile.txt', 'a')
+        d = self.module.Directory(self.workbench, app=self.app)
+        with d.download() as response:
+            self.assertTrue(response.direct_passthrough)
+            self.assertTrue(b''.join(response.response))
+        self.assertTrue(response.response.file._closed)
+
+        wrapped = []
+
+        def file_wrapper(f, buffsize):
+            wrapped.append((f, buffsize))
+            return iter(lambda: f.read(buffsize), b'')
+
+        environ = {'wsgi.file_wrapper': file_wrapper}
+        with self.app.test_request_context(environ_overrides=environ):
+            with d.download() as response:
+                self.assertTrue(b''.join(response.response))
+        self.assertEqual(len(wrapped), 1)
+        self.assertIsInstance(wrapped[0][0], browsepy.stream.TarFileStream)
+        self.assertTrue(wrapped[0][0]._closed)
+
     def test_choose_filename(self):
         f = self.module.Directory(self.workbench, app=self.app)
         first_file = os.path.join(self.workbench, 'testfile.txt')
@@ -195,7 +217,7 @@ class TestFile(unittest.TestCase):
         filename = f.choose_filename('testfile.txt', attempts=0)
         self.assertEqual(filename, 'testfile.txt')
 
-        open(first_file, 'w').close()
+        test_utils.touch(first_file)
 
         filename = f.choose_filename('testfile.txt', attempts=0)
         self.assertNotEqual(filename, 'testfile (2).txt')
@@ -204,7 +226,7 @@ class TestFile(unittest.TestCase):
         self.assertEqual(filename, 'testfile (2).txt')
 
         second_file = os.path.join(self.workbench, filename)
-        open(second_file, 'w').close()
+        test_utils.touch(second_file)
 
         filename = f.choose_filename('testfile.txt', attempts=3)
         self.assertEqual(filename, 'testfile (3).txt')
@@ -224,84 +246,52 @@ class TestFileFunctions(unittest.TestCase):
             self.assertEqual(fnc(1000**n, False), (1, unit))
 
     def test_secure_filename(self):
-        self.assertEqual(self.module.secure_filename('/path'), 'path')
-        self.assertEqual(self.module.secure_filename('..'), '')
-        self.assertEqual(
-            self.module.secure_filename('::'),
-            '__' if os.name == 'nt' else ''
-            )
-        self.assertEqual(self.module.secure_filename('\0'), '_')
-        self.assertEqual(self.module.secure_filename('/'), '')
-        self.assertEqual(self.module.secure_filename('C:\\'), '')
-        self.assertEqual(
-            self.module.secure_filename('COM1.asdf', destiny_os='nt'),
-            '')
-        self.assertEqual(
-            self.module.secure_filename('\xf1', fs_encoding='ascii'),
-            '_')
+        sf = self.module.secure_filename
+        self.assertEqual(sf('/path'), 'path')
+        self.assertEqual(sf('..'), '')
+        self.assertEqual(sf('::'), '__' if os.name == 'nt' else '')
+        self.assertEqual(sf('\0'), '_')
+        self.assertEqual(sf('/'), '')
+        self.assertEqual(sf('C:\\'), '')
+        self.assertEqual(sf('COM1.asdf', destiny_os='nt'), '')
+        self.assertEqual(sf('\xf1', fs_encoding='ascii'), '_')
 
         if PY_LEGACY:
             expected = unicode('\xf1', encoding='latin-1')  # noqa
-            self.assertEqual(
-                self.module.secure_filename('\xf1', fs_encoding='utf-8'),
-                expected)
-            self.assertEqual(
-                self.module.secure_filename(expected, fs_encoding='utf-8'),
-                expected)
+            self.assertEqual(sf('\xf1', fs_encoding='utf-8'), expected)
+            self.assertEqual(sf(expected, fs_encoding='utf-8'), expected)
         else:
-            self.assertEqual(
-                self.module.secure_filename('\xf1', fs_encoding='utf-8'),
-                '\xf1')
+            self.assertEqual(sf('\xf1', fs_encoding='utf-8'), '\xf1')
 
     def test_alternative_filename(self):
+        af = self.module.alternative_filename
+        self.assertEqual(af('test', 2), 'test (2)')
+        self.assertEqual(af('test.txt', 2), 'test (2).txt')
+        self.assertEqual(af('test.tar.gz', 2), 'test (2).tar.gz')
         self.assertEqual(
-            self.module.alternative_filename('test', 2),
-            'test (2)')
-        self.assertEqual(
-            self.module.alternative_filename('test.txt', 2),
-            'test (2).txt')
-        self.assertEqual(
-            self.module.alternative_filename('test.tar.gz', 2),
-            'test (2).tar.gz')
-        self.assertEqual(
-            self.module.alternative_filename('test.longextension', 2),
+            af('test.longextension', 2),
             'test (2).longextension')
-        self.assertEqual(
-            self.module.alternative_filename('test.tar.tar.tar', 2),
-            'test.tar (2).tar.tar')
-        self.assertNotEqual(
-            self.module.alternative_filename('test'),
-            'test')
+        self.assertEqual(af('test.tar.tar.tar', 2), 'test.tar (2).tar.tar')
+        self.assertNotEqual(af('test'), 'test')
 
     def test_relativize_path(self):
+        rp = self.module.relativize_path
+        self.assertEqual(rp('/parent/child', '/parent', '/'), 'child')
         self.assertEqual(
-            self.module.relativize_path(
-                '/parent/child',
-                '/parent',
-                '/'),
-            'child')
-        self.assertEqual(
-            self.module.relativize_path(
-                '/grandpa/parent/child',
-                '/grandpa/parent',
-                '/'),
+            rp('/grandpa/parent/child', '/grandpa/parent', '/'),
             'child')
         self.assertEqual(
-            self.module.relativize_path(
-                '/grandpa/parent/child',
-                '/grandpa',
-                '/'),
+            rp('/grandpa/parent/child', '/grandpa', '/'),
             'parent/child')
         self.assertRaises(
             browsepy.OutsideDirectoryBase,
-            self.module.relativize_path, '/other', '/parent', '/'
+            rp, '/other', '/parent', '/'
         )
 
     def test_under_base(self):
-        self.assertTrue(
-            self.module.check_under_base('C:\\as\\df\\gf', 'C:\\as\\df', '\\'))
-        self.assertTrue(self.module.check_under_base('/as/df', '/as', '/'))
+        cub = self.module.check_under_base
+        self.assertTrue(cub('C:\\as\\df\\gf', 'C:\\as\\df', '\\'))
+        self.assertTrue(cub('/as/df', '/as', '/'))
 
-        self.assertFalse(
-            self.module.check_under_base('C:\\cc\\df\\gf', 'C:\\as\\df', '\\'))
-        self.assertFalse(self.module.check_under_base('/cc/df', '/as', '/'))
+        self.assertFalse(cub('C:\\cc\\df\\gf', 'C:\\as\\df', '\\'))
+        self.assertFalse(cub('/cc/df', '/as', '/'))
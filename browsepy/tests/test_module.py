@@ -5,10 +5,8 @@ import unittest
 import re
 import os
 import os.path
-import shutil
 import tempfile
 import tarfile
-import xml.etree.ElementTree as ET
 import io
 import mimetypes
 
@@ -23,35 +21,52 @@ import browsepy.__main__
 import browsepy.compat
 import browsepy.tests.utils as test_utils
 
+try:
+    from lxml import etree as ET
+except ImportError:
+    if browsepy.compat.PY_LEGACY:
+        import xml.etree.cElementTree as ET
+    else:
+        import xml.etree.ElementTree as ET  # C accelerated already
+
 PY_LEGACY = browsepy.compat.PY_LEGACY
 range = browsepy.compat.range  # noqa
 
+ROW_XPATH = './/table/tbody/tr'
+H1_XPATH = './/h1'
+LINK_XPATH = './/a'
+UPLOAD_XPATH = './/form//input[@type=\'file\']'
+
+BINARY_DATA = bytes(bytearray(range(256)))
+ASCII_DATA = BINARY_DATA[:127]
+UTF8_DATA = BINARY_DATA[:255].decode('latin-1').encode('utf-8')
+
+if hasattr(ET, 'XPath'):  # lxml, evaluated on C
+    row_link = ET.XPath('string(./*[2]//a/@href)')
+    row_buttons = ET.XPath('./*[3]//a/@class')
+else:
+    def row_link(row):
+        return row[1].find(LINK_XPATH).attrib['href']
+
+    def row_buttons(row):
+        return [
+            button.attrib.get('class')
+            for button in row[2].findall(LINK_XPATH)
+            ]
+
 
 class AppMock(object):
     config = browsepy.app.config.copy()
 
 
 class Page(object):
-    @classmethod
-    def itertext(cls, element):
-        '''
-        Compatible element.itertext()
-        '''
-        if element.text:
-            yield element.text
-        for child in element:
-            for text in cls.itertext(child):
-                yield text
-            if child.tail:
-                yield child.tail
-
     def __init__(self, data, response=None):
         self.data = data
         self.response = response
 
     @classmethod
     def innerText(cls, element, sep=''):
-        return sep.join(cls.itertext(element))
+        return sep.join(element.itertext())
 
     @classmethod
     def from_source(cls, source, response=None):
@@ -59,7 +74,8 @@ class Page(object):
 
 
 class ListPage(Page):
-    path_strip_re = re.compile('\s+/\s+')
+    path_strip_re = re.compile(r'\s+/\s+')
+    parse_cache = {}
 
     def __init__(self, path, directories, files, removable, upload, tarfile,
                  source, response=None):
@@ -74,35 +90,42 @@ class ListPage(Page):
 
     @classmethod
     def from_source(cls, source, response=None):
+        fields = cls.parse_cache.get(source)
+        if fields is None:
+            fields = cls.parse_cache[source] = cls.parse(source)
+        path, directories, files, removable, upload, tarfile = fields
+        return cls(path, list(directories), list(files), removable, upload,
+                   tarfile, source, response)
+
+    @classmethod
+    def parse(cls, source):
         html = ET.fromstring(source)
-        rows = [
-            (
-                row[0].attrib.get('class') == 'icon inode',
-                row[1].find('.//a').attrib['href'],
-                any(button.attrib.get('class') == 'button remove'
-                    for button in row[2].findall('.//a')),
-                any(button.attrib.get('class') == 'button download'
-                    for button in row[2].findall('.//a'))
-            )
-            for row in html.findall('.//table/tbody/tr')
-        ]
-        return cls(
+        directories = []
+        files = []
+        removable = True
+        downloadable = True
+        rows = False
+        for row in html.findall(ROW_XPATH):
+            rows = True
+            buttons = row_buttons(row)
+            removable = removable and 'button remove' in buttons
+            url = row_link(row)
+            if row[0].attrib.get('class') == 'icon inode':
+                directories.append(url)
+                downloadable = downloadable and 'button download' in buttons
+            else:
+                files.append(url)
+        return (
             cls.path_strip_re.sub(
                 '/',
-                cls.innerText(html.find('.//h1'), '/')
+                cls.innerText(html.find(H1_XPATH), '/')
                 ).strip(),
-            [url for isdir, url, removable, download in rows if isdir],
-            [url for isdir, url, removable, download in rows if not isdir],
-            all(removable
-                for isdir, url, removable, download in rows
-                ) if rows else False,
-            html.find('.//form//input[@type=\'file\']') is not None,
-            all(download
-                for isdir, url, removable, download in rows if isdir
-                ) if rows else False,
-            source,
-            response
-        )
+            tuple(directories),
+            tuple(files),
+            removable and rows,
+            html.find(UPLOAD_XPATH) is not None,
+            downloadable and rows,
+            )
 
 
 class ConfirmPage(Page):
@@ -158,22 +181,62 @@ class TestApp(unittest.TestCase):
         None: PageException
     }
 
-    def setUp(self):
-        self.app = self.module.app
-        self.base = tempfile.mkdtemp()
-        self.start = os.path.join(self.base, 'start')
-        self.remove = os.path.join(self.base, 'remove')
-        self.upload = os.path.join(self.base, 'upload')
-        self.exclude = os.path.join(self.base, 'exclude')
+    fixture_tree = {
+        'start': ('testfile.txt',),
+        'remove': ('testfile.txt',),
+        'upload': (),
+        'exclude': ('testfile.txt',),
+        }
+
+    @classmethod
+    def setUpClass(cls):
+        cls.url_cache = {}
+        cls.base = tempfile.mkdtemp()
+        cls.start = os.path.join(cls.base, 'start')
+        cls.remove = os.path.join(cls.base, 'remove')
+        cls.upload = os.path.join(cls.base, 'upload')
+        cls.exclude = os.path.join(cls.base, 'exclude')
+        for name, files in cls.fixture_tree.items():
+            os.mkdir(os.path.join(cls.base, name))
+            for filename in files:
+                test_utils.touch(os.path.join(cls.base, name, filename))
+
+    @classmethod
+    def tearDownClass(cls):
+        test_utils.rmtree(cls.base)
+        del cls.url_cache
+
+    @classmethod
+    def restore_fixture_tree(cls):
+        '''
+        Undo filesystem changes made by tests on shared fixture tree.
+        '''
+        tree = cls.fixture_tree
+        for name in os.listdir(cls.base):
+            if name not in tree:
+                cls.remove_path(os.path.join(cls.base, name))
+        for name, files in tree.items():
+            path = os.path.join(cls.base, name)
+            if not os.path.isdir(path):
+                cls.remove_path(path)
+                os.mkdir(path)
+            for filename in os.listdir(path):
+                if filename not in files:
+                    cls.remove_path(os.path.join(path, filename))
+            for filename in files:
+                if not os.path.isfile(os.path.join(path, filename)):
+                    test_utils.touch(os.path.join(path, filename))
 
-        os.mkdir(self.start)
-        os.mkdir(self.remove)
-        os.mkdir(self.upload)
-        os.mkdir(self.exclude)
+    @classmethod
+    def remove_path(cls, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            test_utils.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
 
-        open(os.path.join(self.start, 'testfile.txt'), 'w').close()
-        open(os.path.join(self.remove, 'testfile.txt'), 'w').close()
-        open(os.path.join(self.exclude, 'testfile.txt'), 'w').close()
+    def setUp(self):
+        self.app = self.module.app
+        self.client = self.app.test_client()
 
         def exclude_fnc(path):
             return path == self.exclude \
@@ -202,14 +265,11 @@ class TestApp(unittest.TestCase):
                'Cannot clear directories out of base'
 
         for sub in os.listdir(path):
-            sub = os.path.join(path, sub)
-            if os.path.isdir(sub):
-                shutil.rmtree(sub)
-            else:
-                os.remove(sub)
+            self.remove_path(os.path.join(path, sub))
 
     def tearDown(self):
-        shutil.rmtree(self.base)
+        self.list_page_class.parse_cache.clear()
+        self.restore_fixture_tree()
         test_utils.clear_flask_context()
 
     def get(self, endpoint, **kwargs):
@@ -223,7 +283,7 @@ class TestApp(unittest.TestCase):
             page_class = self.list_page_class
         else:
             page_class = self.generic_page_class
-        with kwargs.pop('client', None) or self.app.test_client() as client:
+        with kwargs.pop('client', None) or self.client as client:
             response = client.get(
                 self.url_for(endpoint, **kwargs),
                 follow_redirects=follow_redirects
@@ -240,12 +300,13 @@ class TestApp(unittest.TestCase):
 
     def post(self, endpoint, **kwargs):
         status_code = kwargs.pop('status_code', 200)
+        follow_redirects = kwargs.pop('follow_redirects', True)
         data = kwargs.pop('data') if 'data' in kwargs else {}
-        with kwargs.pop('client', None) or self.app.test_client() as client:
+        with kwargs.pop('client', None) or self.client as client:
             response = client.post(
                 self.url_for(endpoint, **kwargs),
                 data=data,
-                follow_redirects=True
+                follow_redirects=follow_redirects
                 )
             if response.status_code != status_code:
                 raise self.page_exceptions.get(
@@ -257,8 +318,13 @@ class TestApp(unittest.TestCase):
         return result
 
     def url_for(self, endpoint, **kwargs):
-        with self.app.app_context():
-            return flask.url_for(endpoint, _external=False, **kwargs)
+        key = (endpoint, tuple(sorted(kwargs.items())))
+        url = self.url_cache.get(key)
+        if url is None:
+            with self.app.app_context():
+                url = flask.url_for(endpoint, _external=False, **kwargs)
+            self.url_cache[key] = url
+        return url
 
     def test_index(self):
         page = self.get('index')
@@ -336,7 +402,7 @@ class TestApp(unittest.TestCase):
         )
 
     def test_remove(self):
-        open(os.path.join(self.remove, 'testfile2.txt'), 'w').close()
+        test_utils.touch(os.path.join(self.remove, 'testfile2.txt'))
         page = self.get('remove', path='remove/testfile2.txt')
         self.assertEqual(page.name, 'testfile2.txt')
         self.assertEqual(page.path, 'remove/testfile2.txt')
@@ -383,7 +449,7 @@ class TestApp(unittest.TestCase):
 
     def test_download_file(self):
         binfile = os.path.join(self.base, 'testfile.bin')
-        bindata = bytes(range(256))
+        bindata = BINARY_DATA
 
         with open(binfile, 'wb') as f:
             f.write(bindata)
@@ -410,20 +476,14 @@ class TestApp(unittest.TestCase):
     def test_download_directory(self):
         binfile = os.path.join(self.start, 'testfile.bin')
         excfile = os.path.join(self.start, 'testfile.exc')
-        bindata = bytes(range(256))
+        bindata = BINARY_DATA
         exclude = self.app.config['exclude_fnc']
 
         def tarball_files(path):
             page = self.get('download_directory', path=path)
             iodata = io.BytesIO(page.data)
-            with tarfile.open('p.tgz', mode="r:gz", fileobj=iodata) as tgz:
-                tgz_files = [
-                    member.name
-                    for member in tgz.getmembers()
-                    if member.name
-                    ]
-            tgz_files.sort()
-            return tgz_files
+            with tarfile.open(mode='r|gz', fileobj=iodata) as tgz:
+                return sorted(member.name for member in tgz if member.name)
 
         for path in (binfile, excfile):
             with open(path, 'wb') as f:
@@ -456,25 +516,14 @@ class TestApp(unittest.TestCase):
         )
 
     def test_upload(self):
-        def genbytesio(nbytes, encoding):
-            c = unichr if PY_LEGACY else chr  # noqa
-            return io.BytesIO(''.join(map(c, range(nbytes))).encode(encoding))
-
         files = {
-            'testfile.txt': genbytesio(127, 'ascii'),
-            'testfile.bin': genbytesio(255, 'utf-8'),
+            'file0': (io.BytesIO(ASCII_DATA), 'testfile.txt'),
+            'file1': (io.BytesIO(UTF8_DATA), 'testfile.bin'),
         }
-        output = self.post(
-            'upload',
-            path='upload',
-            data={
-                'file%d' % n: (data, name)
-                for n, (name, data) in enumerate(files.items())
-                }
-            )
+        output = self.post('upload', path='upload', data=files)
         expected_links = sorted(
-            self.url_for('open', path='upload/%s' % i)
-            for i in files
+            self.url_for('open', path='upload/' + name)
+            for _, name in files.values()
             )
         self.assertEqual(sorted(output.files), expected_links)
         self.clear(self.upload)
@@ -482,7 +531,7 @@ class TestApp(unittest.TestCase):
         self.assertRaises(
             Page404Exception,
             self.post, 'upload', path='start', data={
-                'file': (genbytesio(127, 'ascii'), 'testfile.txt')
+                'file': (io.BytesIO(ASCII_DATA), 'testfile.txt')
                 }
             )
 
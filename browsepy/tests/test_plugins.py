@@ -43,13 +43,22 @@ class TestMimetypePluginManager(unittest.TestCase):
 class TestPlugins(unittest.TestCase):
     app_module = browsepy
     manager_module = browsepy.manager
+    expected_endpoints = ['test_a_a', 'test_a_x', 'test_x_a', 'test_x_x']
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = cls.app_module.app
+        cls.plugin_namespace, cls.plugin_name = __name__.rsplit('.', 1)
+        cls.original_manager = cls.app.extensions['plugin_manager']
+        cls.manager = cls.manager_module.PluginManager(cls.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.extensions['plugin_manager'] = cls.original_manager
 
     def setUp(self):
-        self.app = self.app_module.app
         self.original_namespaces = self.app.config['plugin_namespaces']
-        self.plugin_namespace, self.plugin_name = __name__.rsplit('.', 1)
         self.app.config['plugin_namespaces'] = (self.plugin_namespace,)
-        self.manager = self.manager_module.PluginManager(self.app)
 
     def tearDown(self):
         self.app.config['plugin_namespaces'] = self.original_namespaces
@@ -65,10 +74,7 @@ class TestPlugins(unittest.TestCase):
             for action in self.manager.get_widgets(FileMock(mimetype='a/a'))
             )
 
-        self.assertEqual(
-            endpoints,
-            sorted(('test_x_x', 'test_a_x', 'test_x_a', 'test_a_a'))
-            )
+        self.assertEqual(endpoints, self.expected_endpoints)
         self.assertEqual(
             self.app.view_functions['test_plugin.root'](),
             'test_plugin_root'
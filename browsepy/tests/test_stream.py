@@ -0,0 +1,542 @@
+import os
+import os.path
+import io
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import browsepy.stream
+import browsepy.compat
+
+
+GZIP_COMMAND = browsepy.compat.which('gzip')
+
+
+class TestTarFileStream(unittest.TestCase):
+    module = browsepy.stream
+    stream_class = module.TarFileStream
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.base, 'subdir'))
+        for name in ('file.txt', 'file.exc', 'subdir/file.bin'):
+            with open(os.path.join(self.base, name), 'wb') as f:
+                f.write(b'data' * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def stream(self, **kwargs):
+        stream = self.stream_class(self.base, **kwargs)
+        data = b''.join(stream)
+        stream.close()
+        return data
+
+    def names(self, data):
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tgz:
+            return sorted(member.name for member in tgz.getmembers())
+
+    def test_stream(self):
+        data = self.stream(buffsize=512)
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+
+    def test_order(self):
+        os.mkdir(os.path.join(self.base, 'subdir', 'deep'))
+        for name in ('a.txt', 'z.txt', 'subdir/deep/file.bin'):
+            with open(os.path.join(self.base, name), 'wb') as f:
+                f.write(b'data')
+        data = self.stream()
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tgz:
+            names = [member.name for member in tgz.getmembers()]
+        self.assertEqual(names, [
+            '', 'a.txt', 'file.exc', 'file.txt', 'subdir', 'subdir/deep',
+            'subdir/deep/file.bin', 'subdir/file.bin', 'z.txt',
+            ])
+
+    def test_exclude(self):
+        data = self.stream(exclude=lambda path: path.endswith('.exc'))
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+
+    def test_exclude_directory(self):
+        data = self.stream(exclude=lambda path: path.endswith('subdir'))
+        self.assertEqual(self.names(data), ['', 'file.exc', 'file.txt'])
+
+    @unittest.skipUnless(GZIP_COMMAND, 'gzip not found')
+    def test_compress_command(self):
+        class TarFileStream(self.stream_class):
+            compress_command = ('gzip', '-c')
+
+        stream = TarFileStream(self.base)
+        self.assertIsNone(stream._compressor)  # deferred
+        data = b''.join(stream)
+        stream.close()
+        self.assertIsNotNone(stream._compressor)
+        self.assertNotIsInstance(stream._compressor.stdin, io.RawIOBase)
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+
+        stream = TarFileStream(self.base, buffsize=512)
+        next(iter(stream))
+        stream.close()
+        stream._th.join()
+        self.assertIsNotNone(stream._compressor.returncode)
+
+    @unittest.skipUnless(GZIP_COMMAND, 'gzip not found')
+    @unittest.skipUnless(
+        browsepy.stream.fcntl and browsepy.stream.F_SETPIPE_SZ,
+        'F_SETPIPE_SZ unavailable'
+        )
+    def test_compress_pipe_size(self):
+        class TarFileStream(self.stream_class):
+            compress_command = ('gzip', '-c')
+            compress_pipe_size = 131072
+
+        stream = TarFileStream(self.base)
+        stream.read(1)
+        F_GETPIPE_SZ = 1032
+        fcntl = browsepy.stream.fcntl
+        self.assertEqual(
+            fcntl.fcntl(stream._compressor.stdout, F_GETPIPE_SZ),
+            131072
+            )
+        b''.join(stream)
+        stream.close()
+
+    @unittest.skipUnless(GZIP_COMMAND, 'gzip not found')
+    def test_fallback_compress_command(self):
+        class TarFileStream(self.stream_class):
+            compress_command = ('non-existing-command',)
+            fallback_compress_command = ('gzip', '-c')
+            gzip_class = None
+
+        stream = TarFileStream(self.base)
+        data = b''.join(stream)
+        stream.close()
+        self.assertIsNotNone(stream._compressor)
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+
+    def test_builtin_gzip(self):
+        class TarFileStream(self.stream_class):
+            compress_command = None
+            fallback_compress_command = None
+            gzip_class = None
+
+        stream = TarFileStream(self.base)
+        data = b''.join(stream)
+        stream.close()
+        self.assertIsNone(stream._compressor)
+        self.assertIsInstance(stream._gzip, self.module.ParallelGzipFile)
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+        self.assertEqual(data[4:8], b'\0\0\0\0')  # gzip mtime
+
+        data2 = b''.join(TarFileStream(self.base))
+        self.assertEqual(data, data2)
+
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tgz:
+            for member in tgz.getmembers():
+                self.assertEqual((member.uid, member.gid), (0, 0))
+                self.assertEqual((member.uname, member.gname), ('', ''))
+
+    def test_gzip_class(self):
+        class TarFileStream(self.stream_class):
+            compress_command = None
+            gzip_class = gzip.GzipFile
+
+        stream = TarFileStream(self.base)
+        data = b''.join(stream)
+        stream.close()
+        self.assertIsNone(stream._compressor)
+        self.assertIsNotNone(stream._gzip)
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+
+    def test_stored_extensions(self):
+        class TarFileStream(self.stream_class):
+            compress_command = None
+            fallback_compress_command = None
+            gzip_class = None
+
+        compressed = len(b''.join(TarFileStream(self.base)))
+        os.rename(
+            os.path.join(self.base, 'file.txt'),
+            os.path.join(self.base, 'file.JPG'),
+            )
+        data = b''.join(TarFileStream(self.base))
+        self.assertGreater(len(data), compressed + 4000)
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.JPG', 'file.exc', 'subdir', 'subdir/file.bin']
+            )
+
+    def test_inline(self):
+        class TarFileStream(self.stream_class):
+            compress_command = None
+            gzip_class = gzip.GzipFile
+
+        stream = TarFileStream(self.base, buffsize=512)
+        inline = b''.join(stream)
+        stream.close()
+        self.assertIsNone(stream._th)
+        self.assertIsNotNone(stream._generator)
+        self.assertEqual(
+            self.names(inline),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+
+    @unittest.skipUnless(browsepy.stream.posix_fadvise, 'fadvise missing')
+    def test_prefetch(self):
+        prefetched = []
+        opened = []
+
+        class TarFileStream(self.stream_class):
+            def _prefetch(self, path):
+                prefetched.append(os.path.relpath(path, self.path))
+                fileobj = super(TarFileStream, self)._prefetch(path)
+                opened.append(fileobj)
+                return fileobj
+
+        stream = TarFileStream(self.base)
+        data = b''.join(stream)
+        stream.close()
+        self.assertEqual(
+            sorted(prefetched),
+            ['file.exc', 'file.txt', os.path.join('subdir', 'file.bin')]
+            )
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+        self.assertTrue(all(f.closed for f in opened))
+
+        added = []
+
+        class DeepTarFileStream(TarFileStream):
+            prefetch_depth = 10
+
+            def _iter_add(self, *args):
+                added.append((args[1], len(prefetched)))
+                return super(DeepTarFileStream, self)._iter_add(*args)
+
+        del prefetched[:]
+        stream = DeepTarFileStream(self.base)
+        b''.join(stream)
+        stream.close()
+        self.assertEqual(added[0], ('', 0))
+        self.assertEqual([n for _, n in added[1:]], [3] * 4)  # all ahead
+
+        if GZIP_COMMAND:  # fed from a thread running ahead of reads
+            DeepTarFileStream.compress_command = ('gzip', '-c')
+            del opened[:]
+            stream = DeepTarFileStream(self.base)
+            stream.read(1)
+            stream.close()
+            self.assertEqual(len(opened), 3)
+            self.assertTrue(all(f.closed for f in opened))  # aborted
+
+    def test_fill_error(self):
+        class TarFileStream(self.stream_class):
+            compress_command = None
+            gzip_class = gzip.GzipFile
+
+            def _iter_add(self, path, arcname, st=None, fileobj=None):
+                if arcname == 'file.txt':
+                    if fileobj is not None:
+                        fileobj.close()
+                    raise IOError('broken')
+                return super(TarFileStream, self)._iter_add(
+                    path, arcname, st, fileobj)
+
+        stream = TarFileStream(self.base)
+        self.assertRaises(IOError, b''.join, stream)
+        stream.close()
+
+        if GZIP_COMMAND:
+            TarFileStream.compress_command = ('gzip', '-c')
+            stream = TarFileStream(self.base)
+            self.assertRaises(IOError, b''.join, stream)
+            stream.close()
+            self.assertIsNotNone(stream._compressor)
+
+    @unittest.skipUnless(GZIP_COMMAND, 'gzip not found')
+    def test_close(self):
+        class TarFileStream(self.stream_class):
+            compress_command = ('gzip', '-c')
+
+        stream = TarFileStream(self.base, buffsize=512)
+        next(iter(stream))
+        stream.close()
+        stream._th.join()
+        self.assertFalse(stream._th.is_alive())
+
+    def test_close_unread(self):
+        stream = self.stream_class(self.base)
+        stream.close()
+        self.assertEqual(stream.read(), b'')
+        self.assertIsNone(stream._th)
+        self.assertIsNone(stream._compressor)
+
+    def test_context_manager(self):
+        with self.stream_class(self.base) as stream:
+            data = b''.join(stream)
+        self.assertTrue(stream._closed)
+        self.assertEqual(
+            self.names(data),
+            ['', 'file.exc', 'file.txt', 'subdir', 'subdir/file.bin']
+            )
+
+
+class TestStreamTarFile(unittest.TestCase):
+    module = browsepy.stream
+    tarfile_class = module.StreamTarFile
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_addfile(self):
+        path = os.path.join(self.base, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'data' * 1000 + b'!')
+
+        class StreamTarFile(self.tarfile_class):
+            copy_bufsize = 512
+
+        output = io.BytesIO()
+        with StreamTarFile.open(fileobj=output, mode='w|') as tar:
+            tar.add(path, 'file.bin')
+        self.assertEqual(len(output.getvalue()) % tarfile.RECORDSIZE, 0)
+
+        output.seek(0)
+        with tarfile.open(fileobj=output, mode='r:') as tar:
+            data = tar.extractfile('file.bin').read()
+        self.assertEqual(data, b'data' * 1000 + b'!')
+
+    def test_write_through(self):
+        path = os.path.join(self.base, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'data' * 10000)
+
+        class Output(io.BytesIO):
+            def write(self, data):
+                writes.append(len(data))
+                return super(Output, self).write(data)
+
+        writes = []
+        output = Output()
+        with self.tarfile_class.open(fileobj=output, mode='w|') as tar:
+            tarinfo = tar.gettarinfo(path, 'file.bin')
+            header = tarinfo.tobuf(tar.format, tar.encoding, tar.errors)
+            with open(path, 'rb') as f:
+                tar.addfile(tarinfo, f)
+        self.assertEqual(writes[0], len(header) + 40000)  # fused
+
+        output.seek(0)
+        with tarfile.open(fileobj=output, mode='r:') as tar:
+            data = tar.extractfile('file.bin').read()
+        self.assertEqual(data, b'data' * 10000)
+
+    def test_statinfo(self):
+        path = os.path.join(self.base, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        paths = [path, self.base]
+        if hasattr(os, 'symlink'):
+            paths.append(os.path.join(self.base, 'symlink'))
+            os.symlink(path, paths[-1])
+        if hasattr(os, 'link'):
+            paths.append(os.path.join(self.base, 'hardlink'))
+            os.link(path, paths[-1])
+
+        attrs = ('name', 'mode', 'uid', 'gid', 'size', 'mtime', 'type',
+                 'linkname', 'devmajor', 'devminor')
+        with tarfile.open(fileobj=io.BytesIO(), mode='w|') as tar:
+            expected = [
+                tar.gettarinfo(path, os.path.basename(path))
+                for path in paths
+                ]
+        with self.tarfile_class.open(fileobj=io.BytesIO(), mode='w|') as tar:
+            result = [
+                tar.statinfo(path, os.path.basename(path), os.lstat(path))
+                for path in paths
+                ]
+        for a, b in zip(expected, result):
+            self.assertEqual(
+                [getattr(a, attr) for attr in attrs],
+                [getattr(b, attr) for attr in attrs],
+                )
+        if hasattr(os, 'link'):
+            self.assertEqual(result[-1].type, tarfile.LNKTYPE)
+
+    @unittest.skipUnless(browsepy.stream.sendfile, 'os.sendfile unavailable')
+    def test_sendfile(self):
+        path = os.path.join(self.base, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'data' * 1000 + b'!')
+
+        calls = []
+
+        class StreamTarFile(self.tarfile_class):
+            def _sendfile(self, fileobj, size):
+                sent = super(StreamTarFile, self)._sendfile(fileobj, size)
+                calls.append(sent)
+                return sent
+
+        output = os.path.join(self.base, 'output.tar')
+        with open(output, 'wb') as f:
+            with StreamTarFile.open(fileobj=f, mode='w|') as tar:
+                tar.add(path, 'file.bin')
+        self.assertEqual(calls, [True])
+
+        with tarfile.open(output, mode='r:') as tar:
+            data = tar.extractfile('file.bin').read()
+        self.assertEqual(data, b'data' * 1000 + b'!')
+
+    def test_header_cache(self):
+        path = os.path.join(self.base, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'data')
+
+        class StreamTarFile(self.tarfile_class):
+            header_cache = self.module.HeaderCache(1)
+
+        def archive():
+            output = io.BytesIO()
+            with StreamTarFile.open(fileobj=output, mode='w|') as tar:
+                tar.add(path, 'file.bin')
+            return output.getvalue()
+
+        data = archive()
+        cache = StreamTarFile.header_cache
+        self.assertEqual(len(cache._data), 1)
+        self.assertEqual(archive(), data)
+
+        os.utime(path, (0, 0))
+        self.assertNotEqual(archive(), data)
+        self.assertEqual(len(cache._data), 1)
+
+    def test_ustar_fallback(self):
+        path = os.path.join(self.base, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        longname = 'a' * 120
+
+        output = io.BytesIO()
+        with self.tarfile_class.open(
+                fileobj=output, mode='w|', format=tarfile.USTAR_FORMAT
+                ) as tar:
+            tar.add(path, 'file.bin')
+            tar.add(path, longname)
+        data = output.getvalue()
+        self.assertNotIn(b'path=', data[:1024])  # no pax header for first
+        self.assertIn(b'path=', data)
+
+        output.seek(0)
+        with tarfile.open(fileobj=output, mode='r:') as tar:
+            self.assertEqual(tar.getnames(), ['file.bin', longname])
+
+
+class TestParallelGzipFile(unittest.TestCase):
+    module = browsepy.stream
+    gzip_class = module.ParallelGzipFile
+
+    def test_write(self):
+        class ParallelGzipFile(self.gzip_class):
+            block_size = 1000
+
+        data = os.urandom(5000) + b'data' * 5000
+        output = io.BytesIO()
+        f = ParallelGzipFile(output, mtime=0, compresslevel=1)
+        for i in range(0, len(data), 777):
+            f.write(data[i:i + 777])
+        f.close()
+        f.close()  # idempotent
+
+        compressed = output.getvalue()
+        self.assertEqual(compressed[4:8], b'\0\0\0\0')
+        with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as f:
+            self.assertEqual(f.read(), data)
+
+    def test_set_compresslevel(self):
+        data = b'data' * 5000
+        output = io.BytesIO()
+        f = self.gzip_class(output, compresslevel=1)
+        f.write(data)
+        f.set_compresslevel(0)
+        f.write(data)
+        f.close()
+
+        compressed = output.getvalue()
+        self.assertGreater(len(compressed), len(data))
+        with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as f:
+            self.assertEqual(f.read(), data * 2)
+
+    def test_pool(self):
+        class ParallelGzipFile(self.gzip_class):
+            pool = None
+            pool_pid = None
+
+        pool = ParallelGzipFile.get_pool()
+        self.assertIs(ParallelGzipFile.get_pool(), pool)
+
+        ParallelGzipFile.pool_pid = -1  # as if inherited by a fork
+        self.assertIsNot(ParallelGzipFile.get_pool(), pool)
+        pool.close()
+        pool.join()
+
+        ParallelGzipFile.close_pool()
+        self.assertIsNone(ParallelGzipFile.pool)
+        ParallelGzipFile.close_pool()  # noop
+
+    def test_empty(self):
+        output = io.BytesIO()
+        self.gzip_class(output).close()
+        with gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())) as f:
+            self.assertEqual(f.read(), b'')
+
+
+class TestHeaderCache(unittest.TestCase):
+    module = browsepy.stream
+    cache_class = module.HeaderCache
+
+    def test_cache(self):
+        cache = self.cache_class(2)
+        cache.set('a', b'a')
+        cache.set('b', b'b')
+        self.assertEqual(cache.get('a'), b'a')
+        cache.set('c', b'c')  # discards b
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'a')
+        self.assertEqual(cache.get('c'), b'c')
+
+
+class TestCoalesce(unittest.TestCase):
+    module = browsepy.stream
+
+    def test_coalesce(self):
+        coalesce = self.module.coalesce
+        self.assertEqual(
+            list(coalesce(['', 'a', 'bc', 'd', 'efg', 'h'], 3)),
+            ['', 'abc', 'defg', 'h']
+            )
+        self.assertEqual(list(coalesce(['a', 'b', 'c'], 3)), ['a', 'bc'])
+        self.assertEqual(list(coalesce([], 3)), [])
@@ -1,6 +1,11 @@
 
+import os
+import contextlib
+
 import flask
 
+import browsepy.compat as compat
+
 
 def clear_localstack(stack):
     '''
@@ -26,3 +31,57 @@ def clear_flask_context():
     '''
     clear_localstack(flask._app_ctx_stack)
     clear_localstack(flask._request_ctx_stack)
+
+
+def touch(path):
+    '''
+    Create given empty file (or truncate it if existing), without building
+    any file object.
+
+    :param path: file path
+    :type path: str
+    '''
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+
+
+def rmtree(path):
+    '''
+    Remove given directory tree, without following symlinks.
+
+    Simpler than :func:`shutil.rmtree`, as it relies on :func:`os.scandir`
+    entry types instead of calling stat for every entry, and does not
+    handle errors.
+
+    :param path: directory path
+    :type path: str
+    '''
+    for entry in compat.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+    os.rmdir(path)
+
+
+@contextlib.contextmanager
+def environ(**values):
+    '''
+    Context manager setting given environment variables, restoring their
+    previous values (or removing them) on exit.
+
+    Works as :func:`unittest.mock.patch.dict` over :data:`os.environ`,
+    which is not available on Python 2.
+
+    :param values: environment variable values
+    :type values: str
+    '''
+    old = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value